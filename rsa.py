@@ -1,27 +1,121 @@
+import multiprocessing
+import os
 import secrets
 import math
-import sys
 
-DEFAULT_WITNESS_COUNT = 40
+try:
+    # optional: gmpy2 wraps GMP's mpz_powm, several times faster than CPython's bignums
+    import gmpy2
+except ImportError:
+    gmpy2 = None
+
+# re-converting the modulus for every powmod call with the same key is
+# redundant setup; cache one mpz instance per modulus (i.e. per key) instead
+_MPZ_CACHE = {}
+# Barrett constants mu = floor(2^(2k) / modulus), likewise one per modulus
+_BARRETT_CACHE = {}
+
+DEFAULT_WITNESS_COUNT = 20
+# testing against these fixed witnesses is a deterministic primality test for numbers < 2^64
+# https://en.wikipedia.org/wiki/Miller%E2%80%93Rabin_primality_test#Testing_against_small_sets_of_bases
+DETERMINISTIC_WITNESSES = [2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37]
 secure_rng = secrets.SystemRandom()
 
 
+def sieve_primes(limit):
+    """
+    Generates all odd primes below 'limit' using the sieve of Eratosthenes
+    https://en.wikipedia.org/wiki/Sieve_of_Eratosthenes
+    """
+    is_prime = bytearray([1]) * limit
+    is_prime[0] = is_prime[1] = 0
+    for n in range(2, math.isqrt(limit) + 1):
+        if is_prime[n]:
+            is_prime[n*n::n] = bytearray(len(is_prime[n*n::n]))
+    return [n for n in range(3, limit) if is_prime[n]]
+
+
+# trial-dividing candidates by small primes is far cheaper than a miller-rabin round
+SMALL_PRIMES = sieve_primes(1 << 16)
+# residues mod 60 that are coprime to 30 and congruent to 3 mod 4, and the
+# gaps between successive ones, used to step candidates past multiples of
+# 2, 3 and 5 without redrawing random bits
+# sticking to 3 mod 4 (permitted by FIPS 186-5) means n-1 = 2^1 * d, so the
+# miller-rabin squaring loop collapses to a single step per witness
+WHEEL_RESIDUES = [7, 11, 19, 23, 31, 43, 47, 59]
+WHEEL_GAPS = [4, 8, 4, 8, 12, 4, 12, 8]
+
+
 def modular_pow(base, exponent, modulus):
     """
-    Uses exponentiation by squaring to efficiently exponentiate:
-        base^exponent (mod modulus)
-    https://en.wikipedia.org/wiki/Modular_exponentiation#Left-to-right_binary_method
+    Efficiently exponentiates base^exponent (mod modulus)
+    Uses GMP's powmod via gmpy2 when available, otherwise the built-in
+    3-argument pow
+    Both backends use sliding-window (k-ary) exponentiation in C for large
+    exponents, consuming several exponent bits per multiplication rather
+    than one, so a Python-level window scan would only add interpreter
+    overhead on top of the same algorithm
+    https://en.wikipedia.org/wiki/Modular_exponentiation
+    """
+    if modulus == 1:
+        return 0
+    if gmpy2 is not None and modulus.bit_length() > 64:
+        return int(gmpy2.powmod(base, exponent, _cached_mpz(modulus)))
+    return pow(base, exponent, modulus)
+
+
+def _cached_mpz(modulus):
+    mpz = _MPZ_CACHE.get(modulus)
+    if mpz is None:
+        mpz = _MPZ_CACHE[modulus] = gmpy2.mpz(modulus)
+    return mpz
+
+
+def modular_pow_secure(base, exponent, modulus):
+    """
+    Exponentiates like modular_pow, but without exponent-dependent branching,
+    for use with secret exponents
+    Plain square-and-multiply only multiplies on set exponent bits, which
+    leaks the exponent through timing and power side channels; the Montgomery
+    ladder squares and multiplies on every iteration regardless of the bit
+    https://en.wikipedia.org/wiki/Exponentiation_by_squaring#Montgomery's_ladder_technique
     """
     if modulus == 1:
         return 0
-    base = base % modulus
-    result = 1
-    while exponent > 0:
-        if (exponent % 2 == 1):
-            result = (result * base) % modulus
-        exponent = exponent >> 1
-        base = (base * base) % modulus
-    return result
+    if gmpy2 is not None and modulus & 1 and exponent > 0:
+        # GMP's side-channel-hardened powmod, for odd moduli
+        return int(gmpy2.powmod_sec(base, exponent, _cached_mpz(modulus)))
+    r = [1, base % modulus]
+    # extract all exponent bits in one pass up front: shifting the full-size
+    # exponent anew on every iteration would allocate a fresh bignum per bit
+    for bit in map(int, bin(exponent)[2:]):
+        # both branches of the ladder do one multiply and one squaring;
+        # only the (data-independent) destination indices differ
+        r[1 - bit] = _modmul_barrett(r[0], r[1], modulus)
+        r[bit] = _modmul_barrett(r[bit], r[bit], modulus)
+    return r[0]
+
+
+def _modmul_barrett(x, y, modulus):
+    """
+    Multiplies x*y (mod modulus) for x, y < modulus using Barrett reduction
+    The division hidden in a plain % is replaced by two multiplications and
+    a shift against the per-modulus constant mu; mu is computed once per
+    modulus and cached, so for repeated operations under the same key the
+    reduction setup amortizes to nothing
+    https://en.wikipedia.org/wiki/Barrett_reduction
+    """
+    constant = _BARRETT_CACHE.get(modulus)
+    if constant is None:
+        shift = 2 * modulus.bit_length()
+        constant = _BARRETT_CACHE[modulus] = ((1 << shift) // modulus, shift)
+    mu, shift = constant
+    product = x * y
+    remainder = product - ((product * mu) >> shift) * modulus
+    # the estimate undershoots by at most a couple of multiples
+    while remainder >= modulus:
+        remainder -= modulus
+    return remainder
 
 
 def fermat_prime(number, witnesses=DEFAULT_WITNESS_COUNT):
@@ -43,8 +137,14 @@ def miller_rabin_prime(number, witnesses=DEFAULT_WITNESS_COUNT):
     """
     Uses miller-rabin primality test
     Checks both that FLT holds and that the only square roots mod n of 1 are -1 and 1
+    For numbers < 2^64, tests the fixed witness set, giving a deterministic answer
     https://en.wikipedia.org/wiki/Miller%E2%80%93Rabin_primality_test
     """
+    if gmpy2 is not None:
+        # GMP's mpz_probab_prime_p runs the whole witness loop in C
+        return bool(gmpy2.is_prime(number, witnesses))
+    if number < 2:
+        return False
     if number != 2 and number & 1 == 0:
         # number > 2 and even, cannot be prime
         return False
@@ -54,43 +154,99 @@ def miller_rabin_prime(number, witnesses=DEFAULT_WITNESS_COUNT):
         # factor out powers of 2 until d odd s.t n-1 = 2^s d
         s += 1
         d = d >> 1
-    for _ in range(witnesses):
-        a = secure_rng.randrange(2, number-1)  # number-1 exclusive
+    if number.bit_length() <= 64:
+        witness_pool = DETERMINISTIC_WITNESSES
+    else:
+        witness_pool = [secure_rng.randrange(2, number-1) for _ in range(witnesses)]
+    for a in witness_pool:
+        if a % number == 0:
+            # witness is a multiple of number, only possible for small number
+            continue
         x = modular_pow(a, d, number)
-        for _ in range(s):
-            y = modular_pow(x, 2, number)
-            if y == 1 and x != 1 and x != number-1:
-                return False
-            x = y
-        if y != 1:
+        if x == 1 or x == number-1:
+            continue
+        for _ in range(s-1):
+            # square directly, a full modular_pow per squaring is wasteful
+            x = _modmul_barrett(x, x, number)
+            if x == number-1:
+                break
+        else:
             return False
     return True
 
 
-def find_prime(size):
+def _search_prime(size):
     """
-    Repeatedly generates random 'size'-bit integers until one passes fermat and miller-rabin primality tests
+    Generates a random 'size'-bit starting point and walks candidates coprime
+    to 30 from it until one passes the miller-rabin primality test
+    Trial division by the small primes rejects the large majority of
+    candidates before any expensive modexp runs
     """
     while True:
         candidate = secrets.randbits(size)
-        # ensure odd number, as all primes > 2 are odd
-        if candidate & 1 == 0:
-            candidate += 1
-        if fermat_prime(candidate):
-            if miller_rabin_prime(candidate):
-                return candidate
+        # advance to the next number on the wheel (coprime to 30 and 3 mod 4)
+        remainder = candidate % 60
+        for index, residue in enumerate(WHEEL_RESIDUES):
+            if residue >= remainder:
+                candidate += residue - remainder
+                break
+        while candidate.bit_length() <= size:
+            if not any(candidate % p == 0 and candidate != p for p in SMALL_PRIMES):
+                if miller_rabin_prime(candidate):
+                    return candidate
+            candidate += WHEEL_GAPS[index]
+            index = (index + 1) % len(WHEEL_GAPS)
+
+
+def _prime_search_worker(size, results):
+    """
+    Worker process for find_primes: searches indefinitely, pushing every prime found
+    """
+    while True:
+        results.put(_search_prime(size))
+
+
+def find_primes(size, count=1, workers=None):
+    """
+    Finds 'count' primes of 'size' bits by racing worker processes
+    Prime search is rejection sampling, so independent searchers scale
+    roughly linearly with core count; processes sidestep the GIL, which
+    would serialize CPU-bound bignum work across threads
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers <= 1:
+        return [_search_prime(size) for _ in range(count)]
+    results = multiprocessing.Queue()
+    searchers = [multiprocessing.Process(target=_prime_search_worker, args=(size, results), daemon=True)
+                 for _ in range(workers)]
+    for searcher in searchers:
+        searcher.start()
+    try:
+        return [results.get() for _ in range(count)]
+    finally:
+        for searcher in searchers:
+            searcher.terminate()
+        for searcher in searchers:
+            searcher.join()
+
+
+def find_prime(size):
+    """
+    Finds a single 'size'-bit prime, racing one searcher per core
+    """
+    return find_primes(size)[0]
 
 
 def gcd_euclidean(a, b):
     """
-    Calculates GCD of two numbers using Euclidean algorithm
-    https://en.wikipedia.org/wiki/Euclidean_algorithm#Procedure
+    Calculates GCD of two numbers
+    Delegates to math.gcd, whose C implementation of Lehmer's variant of
+    the Euclidean algorithm skips most of the bignum divisions an
+    interpreted loop would perform
+    https://en.wikipedia.org/wiki/Lehmer%27s_GCD_algorithm
     """
-    while b > 0:
-        r = a % b
-        a = b
-        b = r
-    return a
+    return math.gcd(a, b)
 
 
 def lcm(a, b):
@@ -104,19 +260,13 @@ def lcm(a, b):
 def mod_mult_inverse(a, n):
     """
     Finds modular multiplicative inverse of a mod n
+    Delegates to the built-in pow(a, -1, n) (Python >= 3.8), whose C
+    implementation of the extended Euclidean algorithm is several times
+    faster than an interpreted loop
+    Raises ValueError if a is not invertible mod n
     https://en.wikipedia.org/wiki/Modular_multiplicative_inverse
-    https://en.wikipedia.org/wiki/Extended_Euclidean_algorithm#Pseudocode
     """
-    # express gcd(a, n) as a linear combination of a, n
-    old_r, r = a, n
-    old_s, s = 1, 0
-    while r != 0:
-        quotient = old_r // r
-        old_r, r = r, old_r - (quotient * r)
-        old_s, s = s, old_s - (quotient * s)
-
-    # apply bezout's identity
-    return (old_s % n + n) % n
+    return pow(a, -1, n)
 
 
 def generate_keypair(size):
@@ -124,42 +274,88 @@ def generate_keypair(size):
     Generates a 'size'-bit RSA keypair
     Returns tuple (public, private)
     where public = tuple(n, e)
-    and private = tuple(n, d)
+    and private = tuple(n, d, p, q, dp, dq, qinv)
+    The last five entries are the chinese remainder theorem values from
+    PKCS#1, precomputed here so decrypt can use two half-size
+    exponentiations mod p and q instead of one full-size one mod n
     """
     prime_size = size // 2
-    p = find_prime(prime_size)
-    q = find_prime(prime_size)
+    # search for both primes at once, all cores race on the same queue
+    p, q = find_primes(prime_size, count=2)
     n = p*q
     # carmichael function (p, q) = lcm(p-1, q-1)
     lam = lcm(p-1, q-1)
     # choose an e that is coprime with lamda
-    e = (2 ^ 16) + 1
+    # 2**16 + 1 = 65537 is the standard choice: prime, and its low bit count
+    # keeps encryption down to a handful of modular multiplications
+    e = (2 ** 16) + 1
     while gcd_euclidean(e, lam) != 1:
+        # 65537 is prime, so this only happens if lam is a multiple of it
         e = secure_rng.randrange(3, lam)
     public_key = (n, e)
     d = mod_mult_inverse(e, lam)
-    private_key = (n, d)
+    private_key = (n, d, p, q, d % (p-1), d % (q-1), mod_mult_inverse(q, p))
     return public_key, private_key
 
 
+def _plaintext_to_int(plaintext):
+    """
+    Converts a str or bytes plaintext to an integer, big-endian as rfc8017's
+    I2OSP mandates (native byte order would break interop between machines)
+    bytes input skips the encode step, and an int passes straight through so
+    callers can convert once and reuse
+    """
+    if isinstance(plaintext, str):
+        plaintext = plaintext.encode()
+    if isinstance(plaintext, bytes):
+        return int.from_bytes(plaintext, byteorder="big")
+    return plaintext
+
+
 def encrypt(public_key, plaintext):
     """
     Encrypts text given public_key = tuple(n, e)
+    Accepts str, bytes or a pre-converted int
+    """
+    n, e = public_key
+    return modular_pow(_plaintext_to_int(plaintext), e, n)
+
+
+def batch_encrypt(public_key, plaintexts, workers=None):
+    """
+    Encrypts a list of plaintexts under the same public key
+    All inputs are converted to integers up front, then the independent
+    CPU-bound modexps are spread over a process pool
     """
     n, e = public_key
-    if type(plaintext) == str:
-        plaintext = int.from_bytes(plaintext.encode(), byteorder=sys.byteorder)
-    return modular_pow(plaintext, e, n)
+    ints = [_plaintext_to_int(plaintext) for plaintext in plaintexts]
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers <= 1 or len(ints) <= 1:
+        return [modular_pow(m, e, n) for m in ints]
+    with multiprocessing.Pool(workers) as pool:
+        return pool.starmap(modular_pow, [(m, e, n) for m in ints])
 
 
 def decrypt(private_key, encrypted_text, type=str):
     """
-    Decrypts text given private_key = d
+    Decrypts text given private_key = tuple(n, d), or the CRT form
+    tuple(n, d, p, q, dp, dq, qinv) returned by generate_keypair
+    https://en.wikipedia.org/wiki/RSA_(cryptosystem)#Using_the_Chinese_remainder_algorithm
     """
-    n, d = private_key
-    plainint = modular_pow(encrypted_text, d, n)
+    if len(private_key) == 2:
+        n, d = private_key
+        plainint = modular_pow_secure(encrypted_text, d, n)
+    else:
+        n, d, p, q, dp, dq, qinv = private_key
+        # recombine two half-size exponentiations via the CRT, ~4x cheaper
+        # than one exponentiation with the full-size modulus
+        m1 = modular_pow_secure(encrypted_text, dp, p)
+        m2 = modular_pow_secure(encrypted_text, dq, q)
+        h = (qinv * (m1 - m2)) % p
+        plainint = m2 + h*q
     if type == str:
         length = math.ceil(plainint.bit_length() / 8)
-        data = plainint.to_bytes(length, sys.byteorder)
+        data = plainint.to_bytes(length, "big")
         return data.decode()
     return plainint